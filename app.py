@@ -1,19 +1,46 @@
+import asyncio
+import atexit
+import hmac
 import json
 import logging
 import os
+import threading
 
-from flask import Flask, request
+from flask import Flask, abort, jsonify, request
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (Application, CallbackContext, CallbackQueryHandler,
-                          CommandHandler, PollAnswerHandler)
+                          CommandHandler, PollAnswerHandler, TypeHandler)
+
+from broadcast import Broadcast
+from capture import CAPTURE_DIR, TrafficCapture
+from memdebug import DEBUG_TOKEN, object_report, tracemalloc_report
+from sessions import SessionReaper, is_in_progress
+from stats import STATS_PATH, Stats
+from tenants import TENANT_TOKENS, bot_id, build_applications, tenant_admin_ids, tenant_path
 
 app = Flask(__name__)
 
-# Telegram bot token
-TOKEN = os.getenv('TELEGRAM_TOKEN')
+# Base webhook URL, each bot receives updates at <WEBHOOK_URL>/<token>
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+
+# Bot applications served by this process, keyed by token
+applications = {}
+
+# Event loop running the bot applications; Flask hands updates over to it
+event_loop = asyncio.new_event_loop()
+event_loop_thread = threading.Thread(target=event_loop.run_forever, name='bot-event-loop', daemon=True)
+
+# Abandoned session reapers, keyed by bot token
+reapers = {}
 
-# Webhook URL
-WEBHOOK_URL = f'{os.getenv("WEBHOOK_URL")}/{TOKEN}'
+# Running broadcast tasks, keyed by (bot token, recipients file)
+broadcast_tasks = {}
+
+# Telegram user ids allowed to run admin commands, keyed by bot token
+admin_ids = {}
+
+# Test statistics, keyed by bot token
+stats = {}
 
 # Setting up the logger
 logging.basicConfig(
@@ -32,6 +59,11 @@ file_mapping = {
     '3': ('bot_Hogan/mvpi.json', 'categories_mvpi'),
 }
 
+# Parsed question banks, shared read-only by all users and bots
+question_banks = {}
+
+traffic_capture = TrafficCapture(CAPTURE_DIR) if CAPTURE_DIR else None
+
 class UserState:
     def __init__(self):
         self.category_id = None
@@ -76,6 +108,12 @@ def start_menu_keyboard():
     ]
     return InlineKeyboardMarkup(keyboard)
 
+def resume_keyboard():
+    keyboard = [
+        [InlineKeyboardButton('Продолжить тест', callback_data='resume_test')],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
 def back_to_menu_keyboard():
     keyboard = [
         [InlineKeyboardButton('Вернуться в меню', callback_data='back_to_menu')],
@@ -98,8 +136,11 @@ async def button(update: Update, context: CallbackContext) -> None:
     category_id = callback_data[1] if len(callback_data) > 1 else None
 
     if action == 'cat' and category_id in file_mapping:
-        state: UserState = context.user_data['state']
+        state: UserState = context.user_data.setdefault('state', UserState())
         state.load_category(category_id)
+        # A snapshot of an earlier abandoned test must not be resumed over the new one
+        reapers[context.bot.token].discard_snapshot(update.effective_user.id)
+        stats[context.bot.token].record_start(state.category_name)
         logger.info(f'Starting questions for category {state.category_name}')
         await send_question(update, context, state.get_current_question())
     elif action == 'learn':
@@ -108,6 +149,8 @@ async def button(update: Update, context: CallbackContext) -> None:
         await start_test(update, context)
     elif action == 'back':
         await start(update, context)
+    elif action == 'resume':
+        await resume_test(update, context)
 
 async def send_question(update, context, question):
     chat_id = update.effective_chat.id
@@ -131,26 +174,34 @@ async def send_question(update, context, question):
             "state": context.user_data['state']
         }
     }
-    context.bot_data.update(payload)
+    replace_pending_poll(context, message.poll.id, payload)
 
 async def receive_poll_answer(update: Update, context: CallbackContext) -> None:
     answer = update.poll_answer
     poll_id = answer.poll_id
     selected_option = answer.option_ids[0]
-    payload = context.bot_data[poll_id]
+    # Answered polls are dropped so bot_data only holds the pending one per user
+    payload = context.bot_data.pop(poll_id, None)
+    if context.user_data.get('poll_id') == poll_id:
+        del context.user_data['poll_id']
+    if payload is None:
+        logger.info(f'Ignoring answer to unknown poll {poll_id}')
+        return
     state = payload["state"]
 
     current_question = state.get_current_question()
     selected_option_text = current_question['options'][selected_option]['text']
 
     logger.info(f'Received option: {selected_option_text} for question index: {state.question_index}')
-    record_answer(state.category_name, state.get_current_scale()['title'], current_question, selected_option_text)
+    record_answer(stats[context.bot.token], state.category_name, state.get_current_scale()['title'],
+                  state.question_index, current_question, selected_option_text)
     logger.debug('Answer recorded successfully')
 
     if state.next_question():
         next_question = state.get_current_question()
         await send_question_by_id(payload["chat_id"], context, next_question)
     else:
+        stats[context.bot.token].record_completion(state.category_name)
         await context.bot.send_message(
             chat_id=payload["chat_id"],
             text='Вы завершили этот раздел!',
@@ -178,12 +229,24 @@ async def send_question_by_id(chat_id, context, question):
             "state": context.user_data['state']
         }
     }
+    replace_pending_poll(context, message.poll.id, payload)
+
+def replace_pending_poll(context, poll_id, payload):
+    # Each user has at most one pending poll: a poll sent earlier for the same
+    # state must not advance it when answered later
+    previous_poll_id = context.user_data.get('poll_id')
+    if previous_poll_id is not None:
+        context.bot_data.pop(previous_poll_id, None)
     context.bot_data.update(payload)
+    context.user_data['poll_id'] = poll_id
 
-def record_answer(category_name, scale_title, question, selected_option_text):
+def record_answer(bot_stats, category_name, scale_title, question_index, question, selected_option_text):
+    bot_stats.record_answer(category_name, scale_title, question_index, selected_option_text)
     logger.info(f'Recorded: {scale_title} - {question["text"]} - {selected_option_text}')
 
 def load_scales_and_questions(category_id):
+    if category_id in question_banks:
+        return question_banks[category_id]
     filename, category_key = file_mapping[category_id]
     with open(filename, encoding='utf-8') as file:
         data = json.load(file)
@@ -191,6 +254,7 @@ def load_scales_and_questions(category_id):
     category_name = category_key
     scales = category_data
     logger.debug(f'Loaded scales and questions for category {category_id}: {scales}')
+    question_banks[category_id] = (category_name, scales)
     return category_name, scales
 
 async def error_handler(update: Update, context: CallbackContext) -> None:
@@ -217,22 +281,178 @@ async def start_test(update: Update, context: CallbackContext) -> None:
         reply_markup=main_menu_keyboard(),
     )
 
-@app.route(f'/{TOKEN}', methods=['POST'])
-def webhook():
-    update = Update.de_json(request.get_json(), application.bot)
-    application.update_queue.put(update)
-    return 'ok'
+async def broadcast(update: Update, context: CallbackContext) -> None:
+    if update.effective_user.id not in admin_ids[context.bot.token]:
+        return
+    if not context.args:
+        await update.message.reply_text('Использование: /broadcast <файл с chat id> [restart]')
+        return
+    recipients_path = context.args[0]
+    if not os.path.exists(recipients_path):
+        await update.message.reply_text(f'Файл {recipients_path} не найден')
+        return
+    key = (context.bot.token, recipients_path)
+    if key in broadcast_tasks:
+        await update.message.reply_text(f'Рассылка по {recipients_path} уже идет')
+        return
+    job = Broadcast(
+        context.bot,
+        recipients_path,
+        text='Приглашаем вас пройти тест HDS! Выберите категорию:',
+        reply_markup=main_menu_keyboard(),
+        restart=context.args[1:2] == ['restart'],
+    )
+    if job.finished:
+        await update.message.reply_text(
+            f'Рассылка по {recipients_path} уже завершена: {job.counts}. '
+            f'Чтобы отправить заново: /broadcast {recipients_path} restart'
+        )
+        return
+    # The broadcast runs as a separate task so it neither blocks update handling
+    # nor delays application shutdown; once cancelled it resumes from its checkpoint
+    broadcast_tasks[key] = asyncio.create_task(
+        run_broadcast(job, context.bot, update.effective_chat.id, key)
+    )
+    if job.line:
+        await update.message.reply_text(f'Рассылка по {recipients_path} продолжена со строки {job.line}')
+    else:
+        await update.message.reply_text(f'Рассылка по {recipients_path} запущена')
 
-def main() -> None:
-    global application
-    application = Application.builder().token(TOKEN).build()
+async def run_broadcast(job: Broadcast, bot, admin_chat_id, key) -> None:
+    try:
+        counts = await job.run()
+        text = f'Рассылка по {job.recipients_path} завершена: {counts}'
+    except asyncio.CancelledError:
+        logger.info(f'Broadcast {job.recipients_path} cancelled at line {job.line}')
+        raise
+    except Exception as e:
+        logger.error(f'Broadcast {job.recipients_path} failed', exc_info=e)
+        text = f'Рассылка по {job.recipients_path} остановлена на строке {job.line}: {e}'
+    finally:
+        broadcast_tasks.pop(key, None)
+    try:
+        await bot.send_message(chat_id=admin_chat_id, text=text)
+    except Exception as e:
+        logger.error(f'Failed to report broadcast result: {e}')
+
+async def show_stats(update: Update, context: CallbackContext) -> None:
+    if update.effective_user.id not in admin_ids[context.bot.token]:
+        return
+    bot_stats = stats[context.bot.token]
+    if len(context.args) >= 2 and context.args[-1].isdigit():
+        # /stats <scale> <question number>, questions are numbered from 1
+        scale_title = ' '.join(context.args[:-1])
+        question_number = int(context.args[-1])
+        split = bot_stats.get_option_split(scale_title, question_number - 1)
+        lines = [f'{scale_title}, вопрос {question_number}:']
+        lines += [f'{option}: {count}' for option, count in split.items()] or ['нет ответов']
+    else:
+        lines = ['Сегодня:']
+        lines += [f'{category}: начали {counters["starts"]}, завершили {counters["completions"]}'
+                  for category, counters in bot_stats.get_day().items()] or ['нет данных']
+        lines.append('Всего:')
+        lines += [f'{category}: начали {counters["starts"]}, завершили {counters["completions"]}'
+                  for category, counters in bot_stats.totals.items()] or ['нет данных']
+        reaper = reapers[context.bot.token]
+        lines.append(f'Сессии: активных {len(reaper.wheel)}, освобождено {reaper.reclaimed} '
+                     f'(~{reaper.bytes_freed // 1024} КБ)')
+    await update.message.reply_text('\n'.join(lines))
+
+async def resume_test(update: Update, context: CallbackContext) -> None:
+    state = context.user_data.get('state')
+    if not is_in_progress(state):
+        snapshot = reapers[context.bot.token].load_snapshot(update.effective_user.id)
+        if snapshot is None:
+            await start_test(update, context)
+            return
+        state = UserState()
+        state.load_category(snapshot['category_id'])
+        state.scale_index = snapshot['scale_index']
+        state.question_index = snapshot['question_index']
+        context.user_data['state'] = state
+    await send_question(update, context, state.get_current_question())
+
+async def touch_session(update: Update, context: CallbackContext) -> None:
+    if update.effective_user is not None:
+        reapers[context.bot.token].touch(update.effective_user.id)
+
+@app.route('/<token>', methods=['POST'])
+def webhook(token):
+    application = applications.get(token)
+    if application is None:
+        abort(404)
+    update_json = request.get_json()
+    if traffic_capture is not None:
+        traffic_capture.record(bot_id(token), update_json)
+    update = Update.de_json(update_json, application.bot)
+    asyncio.run_coroutine_threadsafe(application.update_queue.put(update), event_loop)
+    return 'ok'
 
+@app.route('/debug/memory', methods=['GET'])
+def debug_memory():
+    token = request.headers.get('X-Debug-Token', '').encode('utf-8')
+    if not DEBUG_TOKEN or not hmac.compare_digest(token, DEBUG_TOKEN.encode('utf-8')):
+        abort(404)
+    report = object_report(
+        {bot_id(token): application for token, application in applications.items()},
+        UserState,
+        shared=[scales for _, scales in question_banks.values()],
+    )
+    if request.args.get('tracemalloc'):
+        top_n = request.args.get('top', 20, type=int)
+        report['tracemalloc'] = tracemalloc_report(top_n, diff=bool(request.args.get('diff')))
+    return jsonify(report)
+
+def register_handlers(application: Application) -> None:
+    admin_ids[application.bot.token] = tenant_admin_ids(application.bot.token)
+    stats[application.bot.token] = Stats(tenant_path(STATS_PATH, application.bot.token))
+    reapers[application.bot.token] = SessionReaper(
+        application,
+        reminder_text='Вы не закончили тест. Продолжим?',
+        reminder_markup=resume_keyboard(),
+    )
+    application.add_handler(TypeHandler(Update, touch_session), group=-1)
     application.add_handler(CommandHandler('start', start))
+    application.add_handler(CommandHandler('broadcast', broadcast))
+    application.add_handler(CommandHandler('stats', show_stats))
     application.add_handler(CallbackQueryHandler(button))
     application.add_handler(PollAnswerHandler(receive_poll_answer))
     application.add_error_handler(error_handler)
 
-    application.bot.set_webhook(url=WEBHOOK_URL)
+async def on_stop(application: Application) -> None:
+    reapers[application.bot.token].stop()
+    stats[application.bot.token].flush()
+    for (token, recipients_path), task in list(broadcast_tasks.items()):
+        if token == application.bot.token:
+            task.cancel()
+
+async def start_applications() -> None:
+    for token, application in applications.items():
+        await application.initialize()
+        await application.start()
+        await application.bot.set_webhook(url=f'{WEBHOOK_URL}/{token}')
+        logger.info(f'Started bot {bot_id(token)}')
+
+async def stop_applications() -> None:
+    for application in applications.values():
+        if application.running:
+            await application.stop()
+            await on_stop(application)
+        await application.shutdown()
+
+def shutdown() -> None:
+    if not event_loop.is_running():
+        return
+    asyncio.run_coroutine_threadsafe(stop_applications(), event_loop).result()
+    event_loop.call_soon_threadsafe(event_loop.stop)
+    event_loop_thread.join()
+
+def main() -> None:
+    applications.update(build_applications(TENANT_TOKENS, register_handlers))
+
+    event_loop_thread.start()
+    asyncio.run_coroutine_threadsafe(start_applications(), event_loop).result()
+    atexit.register(shutdown)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import logging
+import os
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Telegram допускает ~30 сообщений в секунду на бота; часть лимита оставляем
+# живым обработчикам, чтобы рассылка не вытесняла интерактивный трафик
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 20))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 10))
+BROADCAST_MAX_ATTEMPTS = 3
+
+STATUS_SENT = 'sent'
+STATUS_BLOCKED = 'blocked'
+STATUS_RETRY = 'retry'
+STATUS_INVALID = 'invalid'
+
+
+def retry_after_seconds(retry_after):
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class RateLimiter:
+    """
+    Равномерно распределяет отправки во времени: не больше rate сообщений в секунду.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            delay = self._next_slot - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_slot = max(self._next_slot, loop.time()) + self.interval
+
+    def pause(self, seconds):
+        # Flood control от Telegram останавливает всю рассылку, а не одну отправку
+        loop = asyncio.get_running_loop()
+        self._next_slot = max(self._next_slot, loop.time() + seconds)
+
+
+class Broadcast:
+    """
+    Рассылка сообщения по списку chat id из файла (по одному id в строке).
+
+    Рядом с файлом получателей ведутся два файла:
+    <recipients>.checkpoint.json - номер последней обработанной пачки строк и счетчики,
+    <recipients>.outcomes.jsonl - результат по каждому получателю, пишется сразу после отправки.
+    Повторный запуск продолжает рассылку с сохраненной строки и пропускает
+    получателей, результат для которых записан уже после контрольной точки.
+    """
+    def __init__(self, bot, recipients_path, text, reply_markup=None,
+                 rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY, restart=False):
+        self.bot = bot
+        self.recipients_path = recipients_path
+        self.text = text
+        self.reply_markup = reply_markup
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.checkpoint_path = f'{recipients_path}.checkpoint.json'
+        self.outcomes_path = f'{recipients_path}.outcomes.jsonl'
+        self.line = 0
+        self.finished = False
+        self.counts = {STATUS_SENT: 0, STATUS_BLOCKED: 0, STATUS_RETRY: 0, STATUS_INVALID: 0}
+        self.done_lines = set()
+        self._outcomes = None
+        if restart:
+            for path in (self.checkpoint_path, self.outcomes_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.load_checkpoint()
+
+    def load_checkpoint(self):
+        checkpoint = {}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding='utf-8') as file:
+                checkpoint = json.load(file)
+            self.line = checkpoint['line']
+            self.finished = checkpoint.get('finished', False)
+            self.counts.update(checkpoint['counts'])
+        # Результаты, записанные после контрольной точки, лежат в конце файла;
+        # если первая пачка не успела завершиться, файл читается с начала
+        if os.path.exists(self.outcomes_path):
+            with open(self.outcomes_path, 'rb') as file:
+                file.seek(checkpoint.get('outcomes_offset', 0))
+                for line in file:
+                    try:
+                        outcome = json.loads(line)
+                    except ValueError:
+                        # Строка, оборванная при аварийной остановке
+                        continue
+                    if outcome['line'] > self.line and outcome['line'] not in self.done_lines:
+                        self.done_lines.add(outcome['line'])
+                        self.counts[outcome['status']] += 1
+        if checkpoint or self.done_lines:
+            logger.info(f'Resuming broadcast {self.recipients_path} from line {self.line}, '
+                        f'{len(self.done_lines)} recipients after it already processed')
+
+    def save_checkpoint(self):
+        tmp_path = f'{self.checkpoint_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({
+                'line': self.line,
+                'counts': self.counts,
+                'outcomes_offset': self._outcomes.tell(),
+                'finished': self.finished,
+            }, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def iter_batches(self):
+        # Файл читается потоково: в памяти держится только текущая пачка
+        batch = []
+        with open(self.recipients_path, encoding='utf-8') as file:
+            for line_number, line in enumerate(file, start=1):
+                if line_number <= self.line:
+                    continue
+                batch.append((line_number, line.strip()))
+                if len(batch) >= self.concurrency:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def record(self, line_number, chat_id, status):
+        self._outcomes.write(json.dumps({'line': line_number, 'chat_id': chat_id, 'status': status}) + '\n')
+        self._outcomes.flush()
+        self.counts[status] += 1
+
+    async def send(self, chat_id):
+        for attempt in range(1, BROADCAST_MAX_ATTEMPTS + 1):
+            await self.limiter.wait()
+            try:
+                await self.bot.send_message(
+                    chat_id=chat_id,
+                    text=self.text,
+                    reply_markup=self.reply_markup,
+                )
+                return STATUS_SENT
+            except RetryAfter as e:
+                logger.warning(f'Broadcast flood control, pausing for {e.retry_after}s')
+                self.limiter.pause(retry_after_seconds(e.retry_after))
+            except Forbidden:
+                return STATUS_BLOCKED
+            except BadRequest as e:
+                logger.warning(f'Broadcast to {chat_id} rejected: {e}')
+                return STATUS_BLOCKED
+            except NetworkError as e:
+                logger.warning(f'Broadcast to {chat_id} failed (attempt {attempt}): {e}')
+        return STATUS_RETRY
+
+    async def process(self, line_number, line):
+        if not line or line.startswith('#') or line_number in self.done_lines:
+            return
+        try:
+            chat_id = int(line)
+        except ValueError:
+            logger.warning(f'Broadcast {self.recipients_path}:{line_number}: invalid chat id {line!r}')
+            self.record(line_number, line, STATUS_INVALID)
+            return
+        self.record(line_number, chat_id, await self.send(chat_id))
+
+    async def run(self):
+        if self.finished:
+            return self.counts
+        logger.info(f'Starting broadcast {self.recipients_path}')
+        with open(self.outcomes_path, 'a', encoding='utf-8') as self._outcomes:
+            for batch in self.iter_batches():
+                # Ошибка одной отправки не должна закрыть файл результатов,
+                # пока остальные отправки пачки еще идут
+                results = await asyncio.gather(
+                    *(self.process(line_number, line) for line_number, line in batch),
+                    return_exceptions=True,
+                )
+                for result in results:
+                    if isinstance(result, BaseException):
+                        raise result
+                self.line = batch[-1][0]
+                self.save_checkpoint()
+            self.finished = True
+            self.save_checkpoint()
+        self.done_lines.clear()
+        logger.info(f'Broadcast {self.recipients_path} finished: {self.counts}')
+        return self.counts
@@ -0,0 +1,98 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Каталог для записи входящих обновлений; если не задан, запись выключена
+CAPTURE_DIR = os.getenv('CAPTURE_DIR')
+CAPTURE_MAX_BYTES = int(os.getenv('CAPTURE_MAX_BYTES', 50 * 1024 * 1024))
+CAPTURE_MAX_FILES = int(os.getenv('CAPTURE_MAX_FILES', 20))
+CAPTURE_QUEUE_SIZE = 10000
+
+
+class TrafficCapture:
+    """
+    Записывает сырые обновления вебхука в сжатые JSONL-файлы с ротацией.
+
+    Обработчик вебхука только кладет обновление в ограниченную очередь, а
+    сериализация и сжатие выполняются в отдельном потоке. Если очередь
+    переполнена, обновление не записывается, но обработка не замедляется.
+    """
+    def __init__(self, directory, max_bytes=CAPTURE_MAX_BYTES, max_files=CAPTURE_MAX_FILES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=CAPTURE_QUEUE_SIZE)
+        self._file = None
+        self._sequence = 0
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='traffic-capture', daemon=True)
+        self._thread.start()
+
+    def record(self, bot, update_json):
+        try:
+            self._queue.put_nowait((time.time(), bot, update_json))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        self._sequence += 1
+        name = f'capture-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{self._sequence:04d}.jsonl.gz'
+        path = os.path.join(self.directory, name)
+        self._file = gzip.open(path, 'ab')
+        for old_path in capture_files(self.directory)[:-self.max_files]:
+            os.remove(old_path)
+        logger.info(f'Capturing webhook traffic to {path}')
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            ts, bot, update_json = item
+            line = json.dumps({'ts': ts, 'bot': bot, 'update': update_json}, ensure_ascii=False) + '\n'
+            try:
+                # max_bytes ограничивает размер файла на диске, то есть уже сжатые байты
+                if self._file is None or self._file.fileobj.tell() >= self.max_bytes:
+                    self._rotate()
+                self._file.write(line.encode('utf-8'))
+                if self._queue.empty():
+                    self._file.flush()
+            except OSError as e:
+                logger.error(f'Failed to write captured update: {e}')
+        if self._file is not None:
+            self._file.close()
+
+
+def capture_files(path):
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, 'capture-*.jsonl.gz')))
+    return [path]
+
+
+def read_capture(path):
+    for filename in capture_files(path):
+        opener = gzip.open if filename.endswith('.gz') else open
+        with opener(filename, 'rt', encoding='utf-8') as file:
+            try:
+                for line in file:
+                    if line.strip():
+                        record = json.loads(line)
+                        # В записях до появления нескольких ботов поля bot нет
+                        yield record['ts'], record.get('bot'), record['update']
+            except (EOFError, ValueError) as e:
+                # Файл, оборванный при остановке процесса, читаем до места обрыва
+                logger.warning(f'Capture file {filename} is truncated: {e}')
@@ -0,0 +1,91 @@
+import gc
+import linecache
+import logging
+import os
+import sys
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+# Токен для доступа к отладочному маршруту; если не задан, маршрут отключен
+DEBUG_TOKEN = os.getenv('DEBUG_TOKEN')
+TRACEMALLOC_FRAMES = 10
+
+_previous_snapshot = None
+
+
+def deep_sizeof(obj, seen):
+    """
+    Приблизительный размер объекта вместе со всем, на что он ссылается.
+
+    Объекты из seen не учитываются повторно, поэтому общие данные
+    засчитываются только первому владельцу.
+    """
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+    return size
+
+
+def _summary(items, seen):
+    return {'count': len(items), 'approx_bytes': sum(deep_sizeof(item, seen) for item in items)}
+
+
+def object_report(applications, state_class, shared=()):
+    """
+    Количество и приблизительный размер состояний, опросов и user_data.
+
+    Каждая группа считается отдельно, поэтому UserState, на который ссылаются
+    и user_data, и опрос в bot_data, входит в размер обеих групп. Объекты из
+    shared (общий банк вопросов) не учитываются нигде.
+    """
+    shared_ids = {id(obj) for obj in shared}
+    states = [obj for obj in gc.get_objects() if isinstance(obj, state_class)]
+    report = {'user_states': _summary(states, set(shared_ids)), 'bots': {}}
+    for name, application in applications.items():
+        # Копии берутся сразу: словари могут меняться в цикле событий во время подсчета
+        bot_data = list(application.bot_data.values())
+        user_data = list(application.user_data.values())
+        report['bots'][name] = {
+            'bot_data_polls': _summary(bot_data, set(shared_ids)),
+            'user_data': _summary(user_data, set(shared_ids)),
+        }
+    return report
+
+
+def tracemalloc_report(top_n, diff):
+    global _previous_snapshot
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        logger.info('tracemalloc started')
+        return {'started': True}
+
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, linecache.__file__),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    report = {'traced_bytes': current, 'peak_bytes': peak}
+    report['top'] = [
+        {'location': str(stat.traceback), 'size_bytes': stat.size, 'count': stat.count}
+        for stat in snapshot.statistics('lineno')[:top_n]
+    ]
+    if diff and _previous_snapshot is not None:
+        report['diff'] = [
+            {'location': str(stat.traceback), 'size_diff_bytes': stat.size_diff, 'count_diff': stat.count_diff}
+            for stat in snapshot.compare_to(_previous_snapshot, 'lineno')[:top_n]
+        ]
+    _previous_snapshot = snapshot
+    return report
@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# Бот записи без поля bot (сделанной до поддержки нескольких ботов)
+DEFAULT_BOT = '1'
+
+# Команды, которые при воспроизведении никогда не выполняются
+SKIPPED_COMMANDS = ('/broadcast',)
+
+
+class FakeBotAPI(ThreadingHTTPServer):
+    """
+    Локальная заглушка Bot API: принимает запросы бота и отвечает правдоподобными объектами.
+
+    Запоминает id последнего опроса, отправленного каждым ботом в каждый чат, чтобы
+    ответы на опросы из записи можно было связать с опросами, созданными при
+    воспроизведении.
+    """
+    def __init__(self, address=('127.0.0.1', 0)):
+        super().__init__(address, FakeBotAPIHandler)
+        self.message_ids = itertools.count(1)
+        self.last_poll = {}
+        self.calls = 0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address
+        return f'http://{host}:{port}/bot'
+
+    def handle_method(self, token, method, params):
+        self.calls += 1
+        if method == 'getMe':
+            bot = token.split(':', 1)[0]
+            return {'id': int(bot), 'is_bot': True, 'first_name': 'Replay', 'username': f'replay_{bot}_bot'}
+        if method not in ('sendMessage', 'sendPoll'):
+            return True
+        chat_id = int(params['chat_id'])
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+        }
+        if method == 'sendMessage':
+            message['text'] = params.get('text', '')
+        else:
+            poll_id = f'replay-{message["message_id"]}'
+            self.last_poll[(token, chat_id)] = poll_id
+            message['poll'] = {
+                'id': poll_id,
+                'question': params.get('question', ''),
+                'options': [{'text': option['text'] if isinstance(option, dict) else option,
+                             'persistent_id': str(index), 'voter_count': 0}
+                            for index, option in enumerate(json.loads(params.get('options', '[]')))],
+                'total_voter_count': 0,
+                'is_closed': False,
+                'is_anonymous': False,
+                'type': 'regular',
+                'allows_multiple_answers': False,
+                'allows_revoting': False,
+                'members_only': False,
+            }
+        return message
+
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        # Путь запроса: /bot<token>/<method>
+        _, bot_path, method = self.path.split('/', 2)
+        token = bot_path[len('bot'):]
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            params = json.loads(body or '{}')
+        else:
+            params = {key: values[0] for key, values in parse_qs(body).items()}
+        result = self.server.handle_method(token, method, params)
+        response = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def isolate_environment(directory):
+    # Обработчики работают с состоянием модулей app, stats и sessions; чтобы
+    # воспроизведение не трогало рабочие файлы, до их импорта все пути
+    # перенаправляются во временный каталог, а права администратора снимаются
+    os.environ['STATS_PATH'] = os.path.join(directory, 'stats.json')
+    os.environ['SESSIONS_DIR'] = os.path.join(directory, 'sessions')
+    for name in list(os.environ):
+        if name == 'ADMIN_IDS' or name.startswith('ADMIN_IDS_'):
+            del os.environ[name]
+    os.environ.pop('CAPTURE_DIR', None)
+
+
+def is_skipped(update_json):
+    text = (update_json.get('message') or {}).get('text') or ''
+    return text.split(' ', 1)[0].split('@', 1)[0] in SKIPPED_COMMANDS
+
+
+async def replay(capture_path, speed, only_bot=None):
+    import app
+    from capture import read_capture
+
+    server = FakeBotAPI()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Для каждого бота из записи - отдельное приложение, как в рабочем процессе
+    applications = {}
+    latencies = []
+    user_tasks = {}
+    skipped = 0
+
+    async def get_application(bot):
+        if bot not in applications:
+            application = Application.builder().token(f'{bot}:replay').base_url(server.base_url).build()
+            app.register_handlers(application)
+            await application.initialize()
+            applications[bot] = application
+        return applications[bot]
+
+    async def process(application, update_json, previous):
+        # Обновления одного пользователя обрабатываются по порядку, как в продакшене
+        if previous is not None:
+            await previous
+        poll_answer = update_json.get('poll_answer')
+        if poll_answer and poll_answer['poll_id'] not in application.bot_data:
+            key = (application.bot.token, poll_answer['user']['id'])
+            poll_answer['poll_id'] = server.last_poll.get(key, poll_answer['poll_id'])
+        started = time.perf_counter()
+        await application.process_update(Update.de_json(update_json, application.bot))
+        latencies.append(time.perf_counter() - started)
+
+    loop = asyncio.get_running_loop()
+    replay_start = loop.time()
+    first_ts = None
+    for ts, bot, update_json in read_capture(capture_path):
+        bot = bot or DEFAULT_BOT
+        if only_bot is not None and bot != only_bot:
+            continue
+        if is_skipped(update_json):
+            skipped += 1
+            continue
+        if first_ts is None:
+            first_ts = ts
+        if speed:
+            delay = replay_start + (ts - first_ts) / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        application = await get_application(bot)
+        user = Update.de_json(update_json, application.bot).effective_user
+        key = (bot, user.id if user else None)
+        user_tasks[key] = asyncio.ensure_future(process(application, update_json, user_tasks.get(key)))
+    await asyncio.gather(*user_tasks.values())
+    elapsed = loop.time() - replay_start
+
+    for application in applications.values():
+        await application.shutdown()
+    server.shutdown()
+    for bot_stats in app.stats.values():
+        bot_stats.flush()
+
+    latencies.sort()
+    count = len(latencies)
+    logger.info(f'Replayed {count} updates for {len(applications)} bots in {elapsed:.2f}s '
+                f'({count / elapsed if elapsed else 0:.1f} updates/s), {server.calls} Bot API calls, '
+                f'{skipped} skipped')
+    logger.info(f'Latency p50={percentile(latencies, 0.5) * 1000:.1f}ms '
+                f'p95={percentile(latencies, 0.95) * 1000:.1f}ms '
+                f'p99={percentile(latencies, 0.99) * 1000:.1f}ms '
+                f'max={percentile(latencies, 1.0) * 1000:.1f}ms')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Воспроизведение записанного трафика вебхука')
+    parser.add_argument('capture', help='файл или каталог с записью (CAPTURE_DIR)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='ускорение относительно исходного темпа, 0 - максимально быстро')
+    parser.add_argument('--bot', help='воспроизвести трафик только этого бота (числовой id)')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix='replay-') as directory:
+        isolate_environment(directory)
+        asyncio.run(replay(args.capture, args.speed, args.bot))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from telegram.error import Forbidden, TelegramError
+
+from broadcast import BROADCAST_RATE, RateLimiter
+from memdebug import deep_sizeof
+from tenants import bot_id
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд бездействия сессия считается брошенной
+SESSION_TIMEOUT = int(os.getenv('SESSION_TIMEOUT', 24 * 60 * 60))
+SESSION_TICK = int(os.getenv('SESSION_TICK', 60))
+SESSIONS_DIR = os.getenv('SESSIONS_DIR', 'sessions')
+# Сколько секунд хранится снимок брошенной сессии и как часто удаляются устаревшие
+SESSION_SNAPSHOT_TTL = int(os.getenv('SESSION_SNAPSHOT_TTL', 30 * 24 * 60 * 60))
+SESSION_SNAPSHOT_PRUNE_INTERVAL = 60 * 60
+
+
+class TimerWheel:
+    """
+    Колесо таймеров с одинаковым для всех ключей таймаутом.
+
+    Ключ лежит в ячейке своего срока истечения, поэтому продление - O(1), а
+    проверка на каждом тике просматривает только одну ячейку. Срок хранится
+    вместе с ключом: если проверка запоздала, ключ с более поздним сроком,
+    попавший в ту же ячейку, не истечет раньше времени.
+    """
+    def __init__(self, timeout, tick, now=None):
+        self.tick = tick
+        self.timeout_ticks = max(1, -(-timeout // tick))
+        self.slots = [{} for _ in range(self.timeout_ticks + 1)]
+        self.slot_of = {}
+        self.current = int((time.time() if now is None else now) // tick)
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def __contains__(self, key):
+        return key in self.slot_of
+
+    def touch(self, key, now=None):
+        now = time.time() if now is None else now
+        deadline = int(now // self.tick) + self.timeout_ticks
+        slot = deadline % len(self.slots)
+        old_slot = self.slot_of.get(key)
+        if old_slot is not None and old_slot != slot:
+            del self.slots[old_slot][key]
+        self.slots[slot][key] = deadline
+        self.slot_of[key] = slot
+
+    def expire(self, now=None):
+        target = int((time.time() if now is None else now) // self.tick)
+        # После долгого простоя достаточно одного оборота колеса
+        steps = min(target - self.current, len(self.slots))
+        self.current = target
+        expired = []
+        for offset in range(steps - 1, -1, -1):
+            slot = self.slots[(target - offset) % len(self.slots)]
+            for key, deadline in list(slot.items()):
+                if deadline <= target:
+                    del slot[key]
+                    del self.slot_of[key]
+                    expired.append(key)
+        return expired
+
+
+class SessionReaper:
+    """
+    Следит за активностью пользователей одного бота и освобождает брошенные сессии.
+
+    При первом истечении таймаута пользователю с незавершенным тестом
+    отправляется напоминание, при втором сессия сохраняется на диск в
+    минимальном виде, а UserState и опросы удаляются из памяти. Снимки
+    старше snapshot_ttl удаляются.
+    """
+    def __init__(self, application, reminder_text, reminder_markup=None,
+                 timeout=SESSION_TIMEOUT, tick=SESSION_TICK, directory=SESSIONS_DIR,
+                 snapshot_ttl=SESSION_SNAPSHOT_TTL):
+        self.application = application
+        self.reminder_text = reminder_text
+        self.reminder_markup = reminder_markup
+        self.wheel = TimerWheel(timeout, tick)
+        self.directory = os.path.join(directory, bot_id(application.bot.token))
+        self.snapshot_ttl = snapshot_ttl
+        self._last_prune = 0
+        self.reminded = set()
+        self.reclaimed = 0
+        self.bytes_freed = 0
+        self._task = None
+
+    def touch(self, user_id):
+        self.wheel.touch(user_id)
+        self.reminded.discard(user_id)
+        if self._task is None:
+            # Цикл проверки запускается с первым обновлением, когда уже есть цикл
+            # событий. Это обычная задача asyncio, а не Application.create_task:
+            # бесконечный цикл не должен задерживать Application.stop()
+            self._task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f'Session sweep failed: {e}', exc_info=e)
+
+    async def sweep(self):
+        to_remind, to_compact = [], []
+        for user_id in self.wheel.expire():
+            state = self.application.user_data.get(user_id, {}).get('state')
+            if user_id not in self.reminded and is_in_progress(state):
+                to_remind.append(user_id)
+            else:
+                to_compact.append(user_id)
+        if to_remind:
+            sent, unreachable = await self.send_reminders(to_remind)
+            for user_id in to_remind:
+                # Пользователь, вернувшийся во время рассылки, уже снова в колесе
+                if user_id in self.wheel or user_id in unreachable:
+                    continue
+                # Напоминание, не отправленное из-за временной ошибки, повторится
+                # после следующего таймаута
+                if user_id in sent:
+                    self.reminded.add(user_id)
+                self.wheel.touch(user_id)
+            # Заблокировавшему бота напомнить нельзя, его сессия сразу сжимается
+            to_compact.extend(unreachable)
+            to_compact = [user_id for user_id in to_compact if user_id not in self.wheel]
+        if to_compact:
+            self.compact(to_compact)
+        if time.time() - self._last_prune >= SESSION_SNAPSHOT_PRUNE_INTERVAL:
+            self.prune_snapshots()
+
+    async def send_reminders(self, user_ids):
+        limiter = RateLimiter(BROADCAST_RATE)
+        sent, unreachable = set(), set()
+
+        async def remind(user_id):
+            await limiter.wait()
+            try:
+                await self.application.bot.send_message(
+                    chat_id=user_id,
+                    text=self.reminder_text,
+                    reply_markup=self.reminder_markup,
+                )
+            except Forbidden as e:
+                logger.info(f'User {user_id} is unreachable for reminders: {e}')
+                unreachable.add(user_id)
+            except TelegramError as e:
+                logger.warning(f'Failed to send reminder to {user_id}: {e}')
+            else:
+                sent.add(user_id)
+
+        await asyncio.gather(*(remind(user_id) for user_id in user_ids))
+        logger.info(f'Sent {len(sent)} of {len(user_ids)} session reminders')
+        return sent, unreachable
+
+    def compact(self, user_ids):
+        freed = 0
+        for user_id in user_ids:
+            self.reminded.discard(user_id)
+            user_data = self.application.user_data.get(user_id, {})
+            state = user_data.get('state')
+            # Банк вопросов общий для всех сессий и при освобождении не учитывается
+            seen = {id(state.scales)} if state is not None else set()
+            freed += deep_sizeof(user_data, seen)
+            if is_in_progress(state):
+                self.save_snapshot(user_id, state)
+            # У пользователя не больше одного ожидающего опроса, его id хранится в user_data
+            payload = self.application.bot_data.pop(user_data.get('poll_id'), None)
+            if payload is not None:
+                freed += deep_sizeof(payload, seen)
+            self.application.drop_user_data(user_id)
+        self.reclaimed += len(user_ids)
+        self.bytes_freed += freed
+        logger.info(f'Reclaimed {len(user_ids)} sessions, freed ~{freed} bytes '
+                    f'(total {self.reclaimed} sessions, ~{self.bytes_freed} bytes)')
+
+    def snapshot_path(self, user_id):
+        return os.path.join(self.directory, f'{user_id}.json')
+
+    def save_snapshot(self, user_id, state):
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot = {
+            'category_id': state.category_id,
+            'scale_index': state.scale_index,
+            'question_index': state.question_index,
+        }
+        with open(self.snapshot_path(user_id), 'w', encoding='utf-8') as file:
+            json.dump(snapshot, file)
+
+    def load_snapshot(self, user_id):
+        path = self.snapshot_path(user_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as file:
+            snapshot = json.load(file)
+        os.remove(path)
+        return snapshot
+
+    def discard_snapshot(self, user_id):
+        try:
+            os.remove(self.snapshot_path(user_id))
+        except FileNotFoundError:
+            pass
+
+    def prune_snapshots(self, now=None):
+        now = time.time() if now is None else now
+        self._last_prune = now
+        removed = 0
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            try:
+                if entry.name.endswith('.json') and now - entry.stat().st_mtime > self.snapshot_ttl:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        if removed:
+            logger.info(f'Removed {removed} expired session snapshots')
+
+
+def is_in_progress(state):
+    return state is not None and state.category_id is not None and state.scale_index < len(state.scales)
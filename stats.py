@@ -0,0 +1,115 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import time
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+STATS_PATH = os.getenv('STATS_PATH', 'stats.json')
+STATS_SNAPSHOT_INTERVAL = int(os.getenv('STATS_SNAPSHOT_INTERVAL', 60))
+# Сколько последних дней хранить в дневных сводках
+STATS_RETENTION_DAYS = 30
+
+
+class Stats:
+    """
+    Инкрементальные счетчики по тестам: начала, завершения и выбор вариантов ответа.
+
+    Счетчики обновляются на каждом событии, поэтому чтение любой цифры - это
+    обращение к словарю, без перечитывания логов и файлов с ответами.
+    Изменения сбрасываются на диск не позже чем через snapshot_interval
+    секунд, даже если новых событий нет, и при завершении процесса.
+    """
+    def __init__(self, path=STATS_PATH, snapshot_interval=STATS_SNAPSHOT_INTERVAL):
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self.totals = {}
+        self.daily = {}
+        self.options = {}
+        self._last_snapshot = time.monotonic()
+        self._dirty = False
+        self._flush_handle = None
+        self.load()
+        atexit.register(self.flush)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.error(f'Failed to load stats snapshot {self.path}: {e}')
+            return
+        self.totals = data.get('totals', {})
+        self.daily = data.get('daily', {})
+        self.options = data.get('options', {})
+        logger.info(f'Loaded stats snapshot from {self.path}')
+
+    def snapshot(self):
+        tmp_path = f'{self.path}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump({'totals': self.totals, 'daily': self.daily, 'options': self.options},
+                          file, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # Изменения остаются несохраненными и записываются при следующей попытке
+            logger.error(f'Failed to write stats snapshot {self.path}: {e}')
+            return
+        self._last_snapshot = time.monotonic()
+        self._dirty = False
+
+    def flush(self):
+        self._flush_handle = None
+        if self._dirty:
+            self.snapshot()
+
+    def maybe_snapshot(self):
+        self._dirty = True
+        remaining = self.snapshot_interval - (time.monotonic() - self._last_snapshot)
+        if remaining <= 0:
+            self.snapshot()
+        elif self._flush_handle is None:
+            # Отложенный сброс на случай, если до следующего события пройдет много времени
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._flush_handle = loop.call_later(remaining, self.flush)
+
+    def _bump(self, category_name, event):
+        today = date.today().isoformat()
+        if today not in self.daily:
+            self.daily[today] = {}
+            for day in sorted(self.daily)[:-STATS_RETENTION_DAYS]:
+                del self.daily[day]
+        for bucket in (self.totals, self.daily[today]):
+            counters = bucket.setdefault(category_name, {'starts': 0, 'completions': 0})
+            counters[event] += 1
+        self.maybe_snapshot()
+
+    def record_start(self, category_name):
+        self._bump(category_name, 'starts')
+
+    def record_completion(self, category_name):
+        self._bump(category_name, 'completions')
+
+    def record_answer(self, category_name, scale_title, question_index, selected_option_text):
+        questions = self.options.setdefault(category_name, {}).setdefault(scale_title, {})
+        counts = questions.setdefault(str(question_index), {})
+        counts[selected_option_text] = counts.get(selected_option_text, 0) + 1
+        self.maybe_snapshot()
+
+    def get_day(self, day=None):
+        day = day or date.today().isoformat()
+        return self.daily.get(day, {})
+
+    def get_option_split(self, scale_title, question_index):
+        for scales in self.options.values():
+            if scale_title in scales:
+                return scales[scale_title].get(str(question_index), {})
+        return {}
@@ -0,0 +1,98 @@
+import logging
+import os
+
+from telegram.error import RetryAfter
+from telegram.ext import Application, BaseRateLimiter
+from telegram.request import HTTPXRequest
+
+from broadcast import RateLimiter, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+# Токены всех ботов, обслуживаемых процессом, через запятую
+TENANT_TOKENS = [token for token in os.getenv('TENANT_TOKENS', os.getenv('TELEGRAM_TOKEN') or '').split(',') if token]
+# Ограничение исходящих запросов каждого бота в секунду
+TENANT_RATE = float(os.getenv('TENANT_RATE', 30))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 256))
+# Общие настройки (ADMIN_IDS, STATS_PATH) действуют без изменений, только если бот один
+MULTI_TENANT = len(TENANT_TOKENS) > 1
+
+
+class SharedHTTPXRequest(HTTPXRequest):
+    """
+    Один пул HTTP-соединений на все боты процесса.
+
+    Каждое приложение вызывает initialize/shutdown у своего запроса, поэтому
+    пул закрывается только после остановки последнего из них.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._users = 0
+
+    async def initialize(self):
+        self._users += 1
+        await super().initialize()
+
+    async def shutdown(self):
+        self._users = max(0, self._users - 1)
+        if self._users == 0:
+            await super().shutdown()
+
+
+class TenantRateLimiter(BaseRateLimiter):
+    """
+    Ограничивает исходящие запросы одного бота, не затрагивая остальных.
+    """
+    def __init__(self, rate=TENANT_RATE):
+        self.rate = rate
+        self.limiter = None
+
+    async def initialize(self):
+        self.limiter = RateLimiter(self.rate)
+
+    async def shutdown(self):
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        await self.limiter.wait()
+        try:
+            return await callback(*args, **kwargs)
+        except RetryAfter as e:
+            self.limiter.pause(retry_after_seconds(e.retry_after))
+            raise
+
+
+def bot_id(token):
+    # Токен - секрет, в логах и отчетах бот обозначается числовым id
+    return token.split(':', 1)[0]
+
+
+def tenant_admin_ids(token):
+    # Администраторы задаются для каждого бота в ADMIN_IDS_<id бота>
+    default = '' if MULTI_TENANT else os.getenv('ADMIN_IDS', '')
+    admin_ids = os.getenv(f'ADMIN_IDS_{bot_id(token)}', default)
+    return {int(user_id) for user_id in admin_ids.split(',') if user_id}
+
+
+def tenant_path(path, token):
+    if not MULTI_TENANT:
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}-{bot_id(token)}{ext}'
+
+
+def build_applications(tokens, register_handlers):
+    shared_request = SharedHTTPXRequest(connection_pool_size=HTTP_POOL_SIZE)
+    applications = {}
+    for token in tokens:
+        application = (
+            Application.builder()
+            .token(token)
+            .request(shared_request)
+            .rate_limiter(TenantRateLimiter())
+            .build()
+        )
+        register_handlers(application)
+        applications[token] = application
+        logger.info(f'Registered bot {bot_id(token)}')
+    return applications
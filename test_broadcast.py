@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import pytest
+
+from broadcast import STATUS_INVALID, STATUS_SENT, Broadcast
+
+
+class Crash(Exception):
+    pass
+
+
+class FakeBot:
+    def __init__(self, crash_on=None):
+        self.sent = []
+        self.crash_on = crash_on
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        await asyncio.sleep(0)
+        if chat_id == self.crash_on:
+            raise Crash(chat_id)
+        self.sent.append(chat_id)
+
+
+def write_recipients(tmp_path, lines):
+    path = tmp_path / 'recipients.txt'
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return str(path)
+
+
+def read_outcomes(path):
+    with open(f'{path}.outcomes.jsonl', encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+
+def run(bot, path, **kwargs):
+    return asyncio.run(Broadcast(bot, path, 'hi', rate=1000, concurrency=4, **kwargs).run())
+
+
+@pytest.mark.parametrize('crash_on, sent_before_crash', [
+    (4, [1, 2, 3]),
+    (6, [1, 2, 3, 4, 5, 7, 8]),
+], ids=['first-batch', 'later-batch'])
+def test_resume_after_crash_sends_no_duplicates(tmp_path, crash_on, sent_before_crash):
+    path = write_recipients(tmp_path, [str(chat_id) for chat_id in range(1, 9)])
+
+    first = FakeBot(crash_on=crash_on)
+    with pytest.raises(Crash):
+        run(first, path)
+    # Остальные отправки пачки успевают записать результат до выхода
+    assert sorted(first.sent) == sent_before_crash
+    assert sorted(outcome['chat_id'] for outcome in read_outcomes(path)) == sent_before_crash
+
+    second = FakeBot()
+    counts = run(second, path)
+
+    assert sorted(first.sent + second.sent) == list(range(1, 9))
+    assert not set(first.sent) & set(second.sent)
+    assert counts[STATUS_SENT] == 8
+    assert sorted(outcome['chat_id'] for outcome in read_outcomes(path)) == list(range(1, 9))
+
+
+def test_resume_after_cancel_in_first_batch(tmp_path):
+    path = write_recipients(tmp_path, [str(chat_id) for chat_id in range(1, 9)])
+    first = FakeBot()
+
+    async def cancel_midway():
+        task = asyncio.create_task(Broadcast(first, path, 'hi', rate=1000, concurrency=4).run())
+        while len(first.sent) < 2:
+            await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_midway())
+    second = FakeBot()
+    counts = run(second, path)
+
+    assert sorted(first.sent + second.sent) == list(range(1, 9))
+    assert counts[STATUS_SENT] == 8
+    assert len(read_outcomes(path)) == 8
+
+
+def test_invalid_lines_are_recorded_and_skipped(tmp_path):
+    path = write_recipients(tmp_path, ['1', '@user', '', '# comment', '2'])
+    bot = FakeBot()
+
+    counts = run(bot, path)
+
+    assert bot.sent == [1, 2]
+    assert counts[STATUS_INVALID] == 1
+    assert {'line': 2, 'chat_id': '@user', 'status': STATUS_INVALID} in read_outcomes(path)
+
+
+def test_finished_broadcast_is_not_repeated_unless_restarted(tmp_path):
+    path = write_recipients(tmp_path, ['1', '2'])
+    run(FakeBot(), path)
+
+    again = FakeBot()
+    job = Broadcast(again, path, 'hi')
+    assert job.finished
+    asyncio.run(job.run())
+    assert again.sent == []
+
+    restarted = FakeBot()
+    run(restarted, path, restart=True)
+    assert restarted.sent == [1, 2]
+    assert len(read_outcomes(path)) == 2
@@ -0,0 +1,20 @@
+import random
+import string
+
+from capture import TrafficCapture, capture_files, read_capture
+
+
+def test_rotation_by_compressed_size_keeps_every_update(tmp_path):
+    capture = TrafficCapture(str(tmp_path), max_bytes=20_000, max_files=100)
+    rng = random.Random(0)
+    for update_id in range(3000):
+        text = ''.join(rng.choices(string.ascii_letters + 'абвгд', k=100))
+        capture.record('7', {'update_id': update_id, 'message': {'text': text}})
+    capture.close()
+
+    files = capture_files(str(tmp_path))
+    # Несжатый объем записи во много раз больше max_bytes, сжатые файлы - нет
+    assert 1 < len(files) < 30
+    records = list(read_capture(str(tmp_path)))
+    assert [update['update_id'] for _, _, update in records] == list(range(3000))
+    assert {bot for _, bot, _ in records} == {'7'}
@@ -0,0 +1,73 @@
+import asyncio
+import gzip
+import json
+import os
+import threading
+import urllib.parse
+import urllib.request
+
+import pytest
+
+import replay
+from replay import FakeBotAPI
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+USER = {'id': 42, 'is_bot': False, 'first_name': 'Test'}
+
+
+@pytest.fixture
+def server():
+    server = FakeBotAPI()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def call(server, token, method, params):
+    # Как и python-telegram-bot, вложенные значения передаются строками JSON
+    data = {key: json.dumps(value) if isinstance(value, list) else value for key, value in params.items()}
+    request = urllib.request.Request(
+        f'{server.base_url}{token}/{method}',
+        data=urllib.parse.urlencode(data).encode('utf-8'),
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)['result']
+
+
+def test_fake_api_remembers_last_poll_per_bot_and_chat(server):
+    first = call(server, '1:replay', 'sendPoll', {'chat_id': 42, 'question': 'Q', 'options': ['a', 'b']})
+    second = call(server, '1:replay', 'sendPoll', {'chat_id': 42, 'question': 'Q', 'options': ['a', 'b']})
+    other_bot = call(server, '2:replay', 'sendPoll', {'chat_id': 42, 'question': 'Q', 'options': ['a']})
+
+    assert [option['text'] for option in first['poll']['options']] == ['a', 'b']
+    assert server.last_poll[('1:replay', 42)] == second['poll']['id'] != first['poll']['id']
+    assert server.last_poll[('2:replay', 42)] == other_bot['poll']['id']
+
+
+def test_recorded_poll_answer_is_remapped_to_replayed_poll(tmp_path, monkeypatch):
+    # Пути к банкам вопросов в app заданы относительно родительского каталога репозитория
+    os.symlink(REPO_DIR, tmp_path / 'bot_Hogan')
+    monkeypatch.chdir(tmp_path)
+    updates = [
+        {'update_id': 1, 'callback_query': {
+            'id': '1', 'from': USER, 'chat_instance': '1', 'data': 'cat_1',
+            'message': {'message_id': 1, 'date': 0, 'chat': {'id': 42, 'type': 'private'}},
+        }},
+        {'update_id': 2, 'poll_answer': {
+            'poll_id': 'recorded-poll', 'user': USER, 'option_ids': [0], 'option_persistent_ids': ['0'],
+        }},
+    ]
+    capture_path = tmp_path / 'capture.jsonl.gz'
+    with gzip.open(capture_path, 'wt', encoding='utf-8') as file:
+        for ts, update in enumerate(updates):
+            file.write(json.dumps({'ts': ts, 'bot': '7', 'update': update}) + '\n')
+
+    asyncio.run(replay.replay(str(capture_path), speed=0))
+
+    import app
+    bot_stats = app.stats['7:replay']
+    assert bot_stats.totals == {'categories_hpi': {'starts': 1, 'completions': 0}}
+    category_name, scales = app.load_scales_and_questions('1')
+    first_option = scales[0]['questions'][0]['options'][0]['text']
+    assert bot_stats.get_option_split(scales[0]['title'], 0) == {first_option: 1}
@@ -0,0 +1,112 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+from telegram.error import Forbidden, NetworkError
+
+from sessions import SessionReaper, TimerWheel
+
+
+def test_key_expires_after_timeout():
+    wheel = TimerWheel(timeout=300, tick=60, now=0)
+    wheel.touch('user', now=0)
+
+    assert wheel.expire(now=240) == []
+    assert wheel.expire(now=300) == ['user']
+    assert len(wheel) == 0
+
+
+def test_touch_postpones_expiry():
+    wheel = TimerWheel(timeout=300, tick=60, now=0)
+    wheel.touch('user', now=0)
+    wheel.touch('user', now=120)
+
+    assert wheel.expire(now=300) == []
+    assert wheel.expire(now=420) == ['user']
+
+
+def test_late_expire_returns_every_due_key_once():
+    wheel = TimerWheel(timeout=300, tick=60, now=0)
+    for key in range(10):
+        wheel.touch(key, now=key * 60)
+
+    # Проверка запоздала больше чем на оборот колеса
+    assert sorted(wheel.expire(now=10_000)) == list(range(10))
+    assert wheel.expire(now=20_000) == []
+
+
+def test_late_expire_keeps_keys_due_later_in_same_slot():
+    wheel = TimerWheel(timeout=300, tick=60, now=0)
+    wheel.touch('old', now=0)
+    wheel.touch('new', now=360)
+
+    # Срок 'new' попадает в ту же ячейку, что и срок 'old', но еще не наступил
+    assert wheel.expire(now=400) == ['old']
+    assert len(wheel) == 1
+    assert wheel.expire(now=660) == ['new']
+
+
+class FakeBot:
+    token = '7:test'
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.reminded = []
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        if chat_id in self.errors:
+            raise self.errors[chat_id]
+        self.reminded.append(chat_id)
+
+
+class FakeApplication:
+    def __init__(self, errors=None):
+        self.bot = FakeBot(errors or {})
+        self.user_data = {}
+        self.bot_data = {}
+
+    def drop_user_data(self, user_id):
+        del self.user_data[user_id]
+
+
+def in_progress_state():
+    return SimpleNamespace(category_id='1', scales=[{}, {}], scale_index=0, question_index=3)
+
+
+def make_reaper(tmp_path, application, user_ids):
+    reaper = SessionReaper(application, 'Продолжим?', timeout=60, tick=60, directory=str(tmp_path))
+    reaper.wheel = TimerWheel(timeout=60, tick=60, now=0)
+    for user_id in user_ids:
+        application.user_data[user_id] = {'state': in_progress_state()}
+        reaper.wheel.touch(user_id, now=0)
+    return reaper
+
+
+def test_only_successfully_reminded_users_are_marked(tmp_path):
+    application = FakeApplication(errors={2: NetworkError('timeout'), 3: Forbidden('blocked')})
+    reaper = make_reaper(tmp_path, application, [1, 2, 3])
+
+    asyncio.run(reaper.sweep())
+
+    assert application.bot.reminded == [1]
+    assert reaper.reminded == {1}
+    # Временная ошибка: напоминание повторится после следующего таймаута
+    assert 2 in reaper.wheel and 2 in application.user_data
+    # Заблокировавший бота сразу сжимается, прогресс сохраняется на диск
+    assert 3 not in reaper.wheel and 3 not in application.user_data
+    assert os.path.exists(reaper.snapshot_path(3))
+
+
+def test_snapshots_are_discarded_and_expire(tmp_path):
+    reaper = make_reaper(tmp_path, FakeApplication(), [])
+    reaper.save_snapshot(1, in_progress_state())
+    reaper.save_snapshot(2, in_progress_state())
+
+    reaper.discard_snapshot(1)
+    reaper.discard_snapshot(1)
+    assert not os.path.exists(reaper.snapshot_path(1))
+
+    reaper.prune_snapshots(now=os.path.getmtime(reaper.snapshot_path(2)) + reaper.snapshot_ttl / 2)
+    assert os.path.exists(reaper.snapshot_path(2))
+    reaper.prune_snapshots(now=os.path.getmtime(reaper.snapshot_path(2)) + reaper.snapshot_ttl + 1)
+    assert not os.path.exists(reaper.snapshot_path(2))
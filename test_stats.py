@@ -0,0 +1,72 @@
+import json
+import os
+from datetime import date, timedelta
+
+from stats import STATS_RETENTION_DAYS, Stats
+
+
+def make_stats(tmp_path):
+    return Stats(str(tmp_path / 'stats.json'), snapshot_interval=3600)
+
+
+def test_starts_and_completions_roll_up_into_totals_and_today(tmp_path):
+    stats = make_stats(tmp_path)
+    stats.record_start('hpi')
+    stats.record_start('hpi')
+    stats.record_completion('hpi')
+    stats.record_start('hds')
+
+    assert stats.totals == {'hpi': {'starts': 2, 'completions': 1}, 'hds': {'starts': 1, 'completions': 0}}
+    assert stats.get_day() == stats.totals
+
+
+def test_daily_buckets_beyond_retention_are_pruned(tmp_path):
+    stats = make_stats(tmp_path)
+    today = date.today()
+    for days_ago in range(1, 40):
+        day = (today - timedelta(days=days_ago)).isoformat()
+        stats.daily[day] = {'hpi': {'starts': 1, 'completions': 0}}
+
+    stats.record_start('hpi')
+
+    assert len(stats.daily) == STATS_RETENTION_DAYS
+    assert today.isoformat() in stats.daily
+    assert (today - timedelta(days=STATS_RETENTION_DAYS)).isoformat() not in stats.daily
+
+
+def test_option_split_counts_answers_per_question(tmp_path):
+    stats = make_stats(tmp_path)
+    stats.record_answer('hpi', 'Адаптация', 0, 'Да')
+    stats.record_answer('hpi', 'Адаптация', 0, 'Да')
+    stats.record_answer('hpi', 'Адаптация', 0, 'Нет')
+    stats.record_answer('hpi', 'Адаптация', 1, 'Нет')
+
+    assert stats.get_option_split('Адаптация', 0) == {'Да': 2, 'Нет': 1}
+    assert stats.get_option_split('Адаптация', 5) == {}
+    assert stats.get_option_split('Нет такой шкалы', 0) == {}
+
+
+def test_flush_writes_snapshot_that_is_loaded_back(tmp_path):
+    stats = make_stats(tmp_path)
+    stats.record_start('hpi')
+    stats.record_answer('hpi', 'Адаптация', 0, 'Да')
+    stats.flush()
+
+    with open(stats.path, encoding='utf-8') as file:
+        assert json.load(file)['totals'] == {'hpi': {'starts': 1, 'completions': 0}}
+    restored = make_stats(tmp_path)
+    assert restored.totals == stats.totals
+    assert restored.daily == stats.daily
+    assert restored.get_option_split('Адаптация', 0) == {'Да': 1}
+
+
+def test_failed_snapshot_keeps_changes_for_next_flush(tmp_path):
+    stats = Stats(str(tmp_path / 'missing' / 'stats.json'), snapshot_interval=0)
+    stats.record_start('hpi')
+    assert not os.path.exists(stats.path)
+
+    os.mkdir(tmp_path / 'missing')
+    stats.flush()
+
+    with open(stats.path, encoding='utf-8') as file:
+        assert json.load(file)['totals'] == {'hpi': {'starts': 1, 'completions': 0}}